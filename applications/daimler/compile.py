@@ -19,7 +19,9 @@ parser.add_argument('-b', '--database-path', dest='imgdb_path',
 parser.add_argument('-m', '--model-path', dest='model_path',
                     help='Store the trained model using this path. Default is model.h5.')
 parser.add_argument('-c', '--code-path', dest='code_path',
-                    help='Path where the file is to be stored. Default is current directory')
+                    help='Folder where the C files are stored. Default is folder output.')
+parser.add_argument('-p', '--parallel', dest='parallel', action='store_true',
+                    help='Calculate convolutions in parallel using OpenMP.')
 
 args = parser.parse_args()
 
@@ -42,8 +44,10 @@ if not Path(code_path).exists():
 images = load_imdb(imgdb_path)
 model = load_model(model_path, compile=False)
 
-general_generator = NNCG()
-general_generator.keras_compile(images["images"], model, code_path, "qsse3", arch="sse3", testing=1000,
-                                quatization=True, test_mode='classification')
-sse_generator = NNCG()
-sse_generator.keras_compile(images["images"], model, code_path, "sse3", arch="sse3", testing=1000)
+# The same generator is used for both variants, so the Keras functions are only created once. The model is not
+# changed in between, so the weights evaluated by the first call are reused.
+generator = NNCG()
+generator.keras_compile(images["images"], model, str(Path(code_path) / "cnn_qsse3.c"), "qsse3", arch="sse3",
+                        testing=1000, quatization=True, test_mode='classification', parallel=args.parallel)
+generator.keras_compile(images["images"], model, str(Path(code_path) / "cnn_sse3.c"), "sse3", arch="sse3",
+                        testing=1000, parallel=args.parallel, reuse_weights=True)
@@ -15,6 +15,8 @@ if __name__ == '__main__':
                         help='Store the trained model using this path. Default is model.h5.', default='fy_1500.h5')
     parser.add_argument('-c', '--code-path', dest='code_path',
                         help='Store the c code in this file. Default is <model_name>.c.')
+    parser.add_argument('-p', '--parallel', dest='parallel', action='store_true',
+                        help='Calculate convolutions in parallel using OpenMP.')
 
     args = parser.parse_args()
 
@@ -29,4 +31,5 @@ if __name__ == '__main__':
         images["y"] = pickle.load(f)
 
     nncg = NNCG()
-    nncg.keras_compile(imdb=images['images'], model=model, code_path='stuff.c', arch="sse3", testing=100)
+    nncg.keras_compile(imdb=images['images'], model=model, code_path='stuff.c', arch="sse3", testing=100,
+                       parallel=args.parallel)
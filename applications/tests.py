@@ -3,7 +3,9 @@ from applications.daimler.loader import random_imdb, load_images, finish_db
 import tensorflow as tf
 from tensorflow.keras.applications.vgg16 import VGG16
 from tensorflow.keras.applications.vgg19 import VGG19
-from tensorflow.keras.layers import Flatten, MaxPooling2D, Convolution2D, Dropout, Dense
+from tensorflow.keras.layers import Flatten, MaxPooling2D, Convolution2D, Dropout, Dense, BatchNormalization, ReLU, \
+    Activation
+from tensorflow.keras.initializers import RandomUniform
 from tensorflow.keras.models import Sequential
 import argparse
 
@@ -25,9 +27,11 @@ def print_success(name):
 '''.format(name))
 
 
-def no_dense_test():
+def no_dense_test(arch='general', parallel=False):
     """
     Tests an example CNN with no dense layer.
+    :param arch: Architecture to generate code for.
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
     :return: None
     """
     num_imgs = 10
@@ -45,13 +49,16 @@ def no_dense_test():
     no_dense.add(Convolution2D(2, (2, 2), activation='softmax'))
     no_dense.add(Flatten())
     images = random_imdb(num_imgs, no_dense.input.shape[1:].as_list())
-    nncg.keras_compile(images, no_dense, 'no_dense.c')
-    print_success('no_dense')
+    nncg.keras_compile(images, no_dense, 'no_dense.c', arch=arch, parallel=parallel)
+    print_success('no_dense ' + arch + (' parallel' if parallel else ''))
 
 
-def dense_test():
+def dense_test(arch='general', blas=False, parallel=False):
     """
     Tests an example CNN with a Dense layer and valid padding.
+    :param arch: Architecture to generate code for.
+    :param blas: Calculate the Dense layer with BLAS?
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
     :return: None.
     """
     num_imgs = 10
@@ -68,13 +75,15 @@ def dense_test():
     dense_model.add(Flatten())
     dense_model.add(Dense(2, activation='softmax'))
     images = random_imdb(num_imgs, dense_model.input.shape[1:].as_list())
-    nncg.keras_compile(images, dense_model, 'dense_model.c')
-    print_success('dense_model')
+    nncg.keras_compile(images, dense_model, 'dense_model.c', arch=arch, blas=blas, parallel=parallel)
+    print_success('dense_model ' + arch + (' blas' if blas else '') + (' parallel' if parallel else ''))
 
 
-def strides_test():
+def strides_test(arch='general', parallel=False):
     """
     Tests an example CNN with additional unusual strides.
+    :param arch: Architecture to generate code for.
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
     :return: None.
     """
     num_imgs = 10
@@ -88,8 +97,79 @@ def strides_test():
     strides_model.add(Flatten())
     strides_model.add(Dense(2, activation='softmax'))
     images = random_imdb(num_imgs, strides_model.input.shape[1:].as_list())
-    nncg.keras_compile(images, strides_model, 'strides.c')
-    print_success('strides')
+    nncg.keras_compile(images, strides_model, 'strides.c', arch=arch, parallel=parallel)
+    print_success('strides ' + arch + (' parallel' if parallel else ''))
+
+
+def batch_norm_test(arch='general', parallel=False):
+    """
+    Tests an example CNN with BatchNormalization and ReLU layers following convolutions. These are fused into the
+    convolutions, except for the leaky ReLU.
+    :param arch: Architecture to generate code for.
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
+    :return: None.
+    """
+    num_imgs = 10
+    nncg = NNCG()
+    bn_model = Sequential()
+    bn_model.add(Convolution2D(8, (3, 3), input_shape=(30, 20, 3), padding='same', use_bias=False))
+    bn_model.add(BatchNormalization(gamma_initializer=RandomUniform(0.5, 1.5), beta_initializer='random_uniform',
+                                    moving_mean_initializer='random_uniform',
+                                    moving_variance_initializer=RandomUniform(0.5, 1.5)))
+    bn_model.add(ReLU())
+    bn_model.add(Convolution2D(16, (3, 3), padding='valid'))
+    bn_model.add(BatchNormalization(scale=False, moving_mean_initializer='random_uniform',
+                                    moving_variance_initializer=RandomUniform(0.5, 1.5)))
+    bn_model.add(Activation('relu'))
+    bn_model.add(MaxPooling2D(pool_size=(2, 2)))
+    bn_model.add(Convolution2D(8, (3, 3), padding='same'))
+    bn_model.add(ReLU(negative_slope=0.1))
+    bn_model.add(Flatten())
+    bn_model.add(Dense(2, activation='softmax'))
+    images = random_imdb(num_imgs, bn_model.input.shape[1:].as_list())
+    nncg.keras_compile(images, bn_model, 'batch_norm.c', arch=arch, parallel=parallel)
+    print_success('batch_norm ' + arch + (' parallel' if parallel else ''))
+
+
+def padding_test(arch='general', parallel=False):
+    """
+    Tests an example CNN with convolutions writing directly into the padded input of the next convolution.
+    :param arch: Architecture to generate code for.
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
+    :return: None.
+    """
+    num_imgs = 10
+    nncg = NNCG()
+    padding_model = Sequential()
+    padding_model.add(Convolution2D(8, (3, 3), input_shape=(12, 10, 2), activation='relu', padding='same'))
+    padding_model.add(Convolution2D(8, (3, 3), padding='same', activation='relu', bias_initializer='random_uniform'))
+    padding_model.add(Convolution2D(4, (3, 3), padding='same', bias_initializer='random_uniform'))
+    padding_model.add(Flatten())
+    padding_model.add(Dense(2, activation='softmax'))
+    images = random_imdb(num_imgs, padding_model.input.shape[1:].as_list())
+    nncg.keras_compile(images, padding_model, 'padding.c', arch=arch, parallel=parallel)
+    print_success('padding ' + arch + (' parallel' if parallel else ''))
+
+
+def pointwise_test(arch='general', parallel=False):
+    """
+    Tests an example CNN with 1x1 convolutions, which are calculated without im2col buffer or filter loops.
+    :param arch: Architecture to generate code for.
+    :param parallel: Calculate the convolutions in parallel with OpenMP?
+    :return: None.
+    """
+    num_imgs = 10
+    nncg = NNCG()
+    pointwise_model = Sequential()
+    pointwise_model.add(Convolution2D(8, (3, 3), input_shape=(20, 15, 3), activation='relu', padding='same'))
+    pointwise_model.add(Convolution2D(16, (1, 1), activation='relu', bias_initializer='random_uniform'))
+    pointwise_model.add(Convolution2D(12, (1, 1), strides=(2, 1), bias_initializer='random_uniform'))
+    pointwise_model.add(Convolution2D(8, (1, 1), strides=(2, 2), activation='relu', bias_initializer='random_uniform'))
+    pointwise_model.add(Flatten())
+    pointwise_model.add(Dense(2, activation='softmax'))
+    images = random_imdb(num_imgs, pointwise_model.input.shape[1:].as_list())
+    nncg.keras_compile(images, pointwise_model, 'pointwise.c', arch=arch, parallel=parallel)
+    print_success('pointwise ' + arch + (' parallel' if parallel else ''))
 
 
 def vgg16_test():
@@ -150,12 +230,31 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--image-folder', dest='img_path',
                         help='Path to the folder containing 0, 1 etc. folders with jpg images. '
                              'Default is not using real images for testing.')
+    parser.add_argument('-b', '--blas', dest='blas', action='store_true',
+                        help='Also test Dense layers calculated with BLAS, requires OpenBLAS.')
+    parser.add_argument('-a', '--avx2', dest='avx2', action='store_true',
+                        help='Also test the architectures avx2 and avx2_fma, requires a CPU with AVX2 and FMA3.')
+    parser.add_argument('-p', '--parallel', dest='parallel', action='store_true',
+                        help='Also test the models with convolutions calculated in parallel, requires OpenMP.')
     args = parser.parse_args()
 
+    archs = ['general', 'sse3']
+    if args.avx2:
+        archs += ['avx2', 'avx2_fma']
+
     # All tests do not need an image database so we just call them.
-    no_dense_test()
-    dense_test()
-    strides_test()
+    for arch in archs:
+        no_dense_test(arch)
+        dense_test(arch)
+        strides_test(arch)
+        batch_norm_test(arch)
+        padding_test(arch)
+        pointwise_test(arch)
+        if args.blas:
+            dense_test(arch, blas=True)
+        if args.parallel:
+            for test in [no_dense_test, dense_test, strides_test, batch_norm_test, padding_test, pointwise_test]:
+                test(arch, parallel=True)
     vgg16_test()
     vgg19_test()
 
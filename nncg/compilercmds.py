@@ -5,20 +5,36 @@ compiler = 'g++ -mssse3 -std=c++11 -g -march=bonnell -DCNN_TEST '
 compiler_O3 = 'g++ -O3 -mssse3 -std=c++11 -march=bonnell -DCNN_TEST '
 compiler_check = 'g++ --version >/dev/null 2>/dev/null'
 
+# Additional flags for architectures with instructions not enabled above.
+arch_flags = {
+    'avx2': '-mavx2 ',
+    'avx2_fma': '-mavx2 -mfma '
+}
+
+# Libraries to link if the code calls BLAS functions.
+blas_libs = ' -lopenblas'
+
 # if os.name == 'nt':
 #    compiler = 'wsl clang++ -mssse3 -std=c++11 -g -march=bonnell -DCNN_TEST '
 #    compiler_O3 = 'wsl clang++ -O3 -mssse3 -std=c++11 -march=bonnell -DCNN_TEST '
 
 
-def compile(path, optimize=False):
+def compile(path, optimize=False, arch='general', parallel=False, blas=False):
     """
     Compile the C file.
     :param path: Path to C file.
     :param optimize: Run compiler with optimizations.
+    :param arch: Architecture the code was generated for.
+    :param parallel: Was the code generated with OpenMP pragmas?
+    :param blas: Does the code call BLAS functions?
     :return:
     """
-    c = compiler_O3 if optimize else compiler
+    c = (compiler_O3 if optimize else compiler) + arch_flags.get(arch, '')
+    if parallel:
+        c += '-fopenmp '
     cmd = c + path + " -o " + path[:path.rfind('.')]
+    if blas:
+        cmd += blas_libs
     if os.system(cmd) != 0:
         print("Error compiling file with command: ", cmd)
         sys.exit(3)
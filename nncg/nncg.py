@@ -1,6 +1,7 @@
+import tensorflow as tf
 import tensorflow.keras.backend as K
 from tensorflow.keras.layers import Convolution2D, MaxPooling2D, Flatten, \
-    Dropout, BatchNormalization, LeakyReLU, InputLayer, Dense
+    Dropout, BatchNormalization, LeakyReLU, InputLayer, Dense, ReLU, Activation
 from pathlib import Path
 from .nodes.cnn import *
 from .nodes.language import CHeaderNode, CFooterNode
@@ -9,10 +10,13 @@ from .nodes.misc import *
 from .nodes.controlflow import *
 from .nodes.controlflow import UnrolledOperation
 from .nodes.macnodesse3 import MACNodeSSE3
+from .nodes.im2colconv import Im2ColConv, Im2ColConvAVX2, Im2ColConvAVX2FMA
+from .nodes.blas import CBlasDense
 from .traverse.actions.searchnode import SearchNodeByType
 from .traverse.actions.writecaction import WriteCAction
 from .traverse.actions.quantizeaction import QuantizeAction
 from .traverse.actions.lower import LowerAction
+from .traverse.actions.foldconstants import FoldConstants
 from .traverse.actions.collectvars import CollectVars
 from .traverse.tree import Edge
 from .compilercmds import compile, compiler_check
@@ -26,6 +30,7 @@ class NNCG:
     """
     root_node: Edge = None
     test_nodes: List[KerasLayerNode] = []
+    test_layers: List = []  # The Keras layer of each node in test_nodes, None for the input.
 
     def __init__(self):
         """
@@ -33,52 +38,100 @@ class NNCG:
         """
         self.id = ""
         self.test_nodes = []
+        self.test_layers = []
         self.testing = None
+        self.parallel = False
         self.model = None
+        # Keras functions and evaluated weights of self.model. The functions are kept for further keras_compile()
+        # calls with the same model, the weights only if requested by reuse_weights.
+        self.keras_functions = {}
+        self.keras_values = {}
         self.min_in = 0
         self.max_in = 0
 
     def keras_compile(self, imdb, model, code_path, identifier=None, image_mean=0, arch="general", testing=-1,
-                      test_mode="error", quatization=False, weights_method='direct'):
+                      test_mode="error", quatization=False, weights_method='direct', parallel=False, blas=False,
+                      reuse_weights=False):
         """
         Main function to run the code generation.
         :param test_mode:
-        :param imdb: Image database as list of numpy array.
+        :param imdb: Image database as list of numpy array or as single numpy array.
         :param model: Keras model.
         :param code_path: Path for writing code.
         :param identifier: Identifier of C code file.
         :param image_mean: Mean to subtract from image.
-        :param arch: Architecture of target device.
+        :param arch: Architecture of target device: 'general', 'sse3' or, using SSE3 for the layers not
+                     supported by the AVX2 convolution, 'avx2' and 'avx2_fma'.
         :param testing: Do testing? -1: all, otherwise number of tests.
         :param test_mode: Defining the mode for testing. In case of "classification", the class will
                           be compared as result. If "regression", the mean error is given. If "error",
                           the test will quit if a value in any layer is larger than a threshold.
         :param weights_method: How to store the weights and bias.
         :param quatization: Convert applicable layers to unit8?
+        :param parallel: Calculate the rows of convolutions in parallel using OpenMP? Requires compiling
+                         with -fopenmp, otherwise the code still runs in a single thread.
+        :param blas: Calculate Dense layers with cblas_sgemv()? Requires a BLAS library like OpenBLAS, without it
+                     the loops of the selected architecture are used.
+        :param reuse_weights: Reuse the weights evaluated by the previous call with the same model instead of
+                              reading them again? Only valid if the model has not been changed, e.g. trained, since.
         :return: None.
         """
 
         self.testing = testing
+        self.parallel = parallel
         path = code_path
 
+        # Convert the images only once, they are used for quantization and each test as float32.
+        imdb = np.ascontiguousarray(imdb, dtype=np.float32)
+
         exe_return_filename = "result.txt"
 
+        if model is not self.model:
+            self.keras_functions = {}
+        if model is not self.model or not reuse_weights:
+            self.keras_values = {}
         self.model = model
+        self.test_nodes = []
+        self.test_layers = []
         input_shape = model.layers[0].input.shape[1:].as_list()
 
         STEPS = 7
         print_progress_bar(0, STEPS, prefix='Adding CNN nodes to graph')
 
         self.root_node = Edge('root', CHeaderNode(identifier, input_shape, weights_method), None, 'forward')
+        CHeaderNode.instance().openmp_required = parallel
 
         cur_node = MeanNode(image_mean, self.root_node.target)
         cur_node = self.add_test_node(cur_node, None)
 
         # Read the Keras model layer by layer and add it to the graph
-
+        fused_layers = []
         for i, layer in enumerate(model.layers):
+            # All features are generated in HWC format and Keras kernels are already in HWIO format. Layers
+            # working on CHW would need a transposed input which is not supported.
+            if getattr(layer, 'data_format', 'channels_last') != 'channels_last':
+                print("Only channels_last is supported, layer {} is {}".format(layer.name, layer.data_format))
+                sys.exit(1)
+            if layer in fused_layers:
+                # Already part of a previous node.
+                continue
             if type(layer) == Convolution2D:
-                cur_node = self.add_conv2d(layer, cur_node)
+                fused_layers = self.get_fusable_layers(layer, model.layers[i + 1:])
+                cur_node = self.add_conv2d(layer, cur_node, fused_layers)
+            elif type(layer) == Activation:
+                if layer.activation.__name__ not in ['relu', 'softmax', 'linear']:
+                    print("Activation {} not supported".format(layer.activation.__name__))
+                    sys.exit(1)
+                cur_node = self.add_activation(layer.activation, cur_node)
+                if self.testing != 0:
+                    cur_node = self.add_test_node(cur_node, layer)
+            elif type(layer) == ReLU:
+                if layer.max_value is not None or float(layer.threshold) != 0:
+                    print("ReLU with max_value or threshold not supported")
+                    sys.exit(1)
+                cur_node = self.add_leaky_relu(float(layer.negative_slope), cur_node)
+                if self.testing != 0:
+                    cur_node = self.add_test_node(cur_node, layer)
             elif type(layer) == MaxPooling2D:
                 cur_node = self.add_maxpool2d(layer, cur_node)
             elif type(layer) == LeakyReLU:
@@ -103,24 +156,31 @@ class NNCG:
         # depend on it.
         print_progress_bar(1, STEPS, prefix='Quantization')
         if quatization:
-            if arch == 'sse3':
+            if arch in ['sse3', 'avx2', 'avx2_fma']:
                 self.quantize(imdb, 'uint8')
 
         # Read in finished, lower to nodes that can be expressed in C.
         print_progress_bar(2, STEPS, prefix='Lowering')
         self.abstract_to_c()
+        if blas:
+            self.to_blas()
 
         # Now convert the graph to the desired architecture. This will heavily change in future
         # when more architectures are supported.
         print_progress_bar(3, STEPS, prefix='Optimization')
         if arch == 'general':
             pass
-        elif arch == 'sse3':
+        elif arch in ['sse3', 'avx2', 'avx2_fma']:
             if quatization:
                 self.to_quantized_sse3()
-                self.to_sse3()
-            else:
-                self.to_sse3()
+            conv_optimization = {'sse3': Im2ColConv, 'avx2': Im2ColConvAVX2, 'avx2_fma': Im2ColConvAVX2FMA}[arch]
+            self.to_sse3(conv_optimization)
+        else:
+            print("Unknown architecture.")
+            sys.exit(1)
+
+        # The graph is final now, Constants can be written directly into the Expressions.
+        self.root_node.traverse(FoldConstants())
 
         print_progress_bar(4, STEPS, prefix='Writing C code')
         self.write_c(path)
@@ -136,23 +196,27 @@ class NNCG:
             testing = len(imdb)
         print_progress_bar(6, STEPS, prefix='Compiling')
 
-        compile(path, optimize=False)
+        compile(path, optimize=False, arch=arch, parallel=parallel, blas=blas)
         print_progress_bar(STEPS, STEPS, prefix='Finished')
         tested = 0
         fail = 0
 
-        for im in np.random.permutation(imdb):
+        # The outputs of all tested layers are calculated by Keras at once.
+        test_func = self.get_keras_function([l for l in self.test_layers if l is not None])
+
+        for i in np.random.permutation(len(imdb)):
             if tested > testing:
                 print("\nTest finished.")
                 break
 
-            im.astype("float32").tofile("img.bin")
+            im = imdb[i]
+            im.tofile("img.bin")
             im = im.reshape(1, *im.shape)
 
             if os.name == 'nt':
                 res = os.system(path[:path.rfind('.')])
             else:
-                res = os.system("./" + path[:path.rfind('.')]) >> 8
+                res = os.system(os.path.join('.', path[:path.rfind('.')])) >> 8
 
             assert res == 0
 
@@ -160,8 +224,10 @@ class NNCG:
             c_res = 0
             res_list = []
             c_res_list = []
-            for n in self.test_nodes:
-                res, c_res = n.test(im, exit_on_err=test_mode == 'error')
+            keras_res = iter(test_func([im, 0]))
+            for n, layer in zip(self.test_nodes, self.test_layers):
+                res, c_res = n.test(im, exit_on_err=test_mode == 'error',
+                                    res=None if layer is None else next(keras_res))
                 res_list.append(res)
                 c_res_list.append(c_res)
             tested += 1
@@ -206,11 +272,32 @@ class NNCG:
         print(" finished")
         return min_in, max_in
 
-    def to_sse3(self):
+    def to_blas(self):
+        """
+        Calculate the Dense layers by BLAS.
+        :return: None
+        """
+        dense_search = SearchNodeByType(DenseNode)
+        dense_search.traverse_edges = ['next', 'content']
+        self.root_node.traverse(dense_search)
+        for n in [r[-1] for r in dense_search.result]:
+            if CBlasDense.applicable(n):
+                CBlasDense.apply(n)
+
+    def to_sse3(self, conv_optimization=Im2ColConv):
         """
         From a general architecture to SSE3.
+        :param conv_optimization: The Im2ColConv variant for the convolutions, e.g. Im2ColConvAVX2.
         :return: None
         """
+        # Convolutions are calculated as matrix multiplication of im2col buffers where possible.
+        conv_search = SearchNodeByType(Conv2DNode)
+        conv_search.traverse_edges = ['next', 'content']
+        self.root_node.traverse(conv_search)
+        for n in [r[-1] for r in conv_search.result]:
+            if conv_optimization.applicable(n):
+                conv_optimization.apply(n)
+
         desired_unroll = 4
         node_type = MACNode
         NNCG.join_loops(self.root_node, desired_unroll, node_type)
@@ -315,22 +402,75 @@ class NNCG:
             while type(root_loop.get_node('content')) is LoopNode:
                 root_loop = root_loop.deep_join()
 
-    def add_conv2d(self, layer: Convolution2D, prev_node) -> Node:
+    @staticmethod
+    def is_plain_relu(layer) -> bool:
+        """
+        Is the Keras layer a ReLU without leakyness, threshold and maximum, i.e. max(x, 0)?
+        :param layer: The Keras layer.
+        :return: True or False.
+        """
+        if type(layer) == Activation:
+            return layer.activation.__name__ == 'relu'
+        if type(layer) == ReLU:
+            return layer.max_value is None and float(layer.threshold) == 0 and float(layer.negative_slope) == 0
+        return False
+
+    @staticmethod
+    def get_fusable_layers(layer: Convolution2D, following_layers) -> List:
+        """
+        Get the layers directly following a Conv2D that can be calculated by the Conv2DNode. A BatchNormalization
+        directly after the convolution is folded into weights and bias and a ReLU is applied to the output of
+        the Conv2DNode instead of creating a separate node and output.
+        :param layer: The Keras Conv2D layer.
+        :param following_layers: All layers following the Conv2D layer.
+        :return: List of layers to fuse.
+        """
+        fused = []
+        if layer.activation.__name__ != 'linear':
+            return fused
+        following_layers = list(following_layers)
+        if len(following_layers) > 0 and type(following_layers[0]) == BatchNormalization and \
+                list(np.atleast_1d(following_layers[0].axis)) in [[-1], [3]]:
+            fused.append(following_layers.pop(0))
+        if len(following_layers) > 0 and NNCG.is_plain_relu(following_layers[0]):
+            fused.append(following_layers.pop(0))
+        return fused
+
+    def add_conv2d(self, layer: Convolution2D, prev_node, fused_layers=None) -> Node:
         """
         Add a Conv2D node to global graph. A layer for testing is also added.
         :param layer: The Keras Conv2D layer.
         :param prev_node: Previous node.
+        :param fused_layers: Layers following the Conv2D that are calculated by this node, given by
+                             get_fusable_layers().
         :return: The NNCG Conv2D node.
         """
-        w = K.eval(layer.weights[0])
-        b = K.eval(layer.bias)
+        if fused_layers is None:
+            fused_layers = []
+        w = self.eval_keras(layer.weights[0])
+        if layer.use_bias:
+            b = self.eval_keras(layer.bias)
+        else:
+            b = np.zeros(w.shape[3], dtype=w.dtype)
         strides = layer.strides
         padding = layer.padding
-        activation = layer.activation
-        cur_node = Conv2DNode(w, b, strides, padding, prev_node)
-        cur_node = self.add_activation(activation, cur_node)
+        relu = layer.activation.__name__ == 'relu'
+        for l in fused_layers:
+            if type(l) == BatchNormalization:
+                # y = gamma * (x - mean) / sqrt(var + eps) + beta with x = w * in + b
+                gamma = self.eval_keras(l.gamma) if l.scale else 1
+                beta = self.eval_keras(l.beta) if l.center else 0
+                f = gamma / np.sqrt(self.eval_keras(l.moving_variance) + l.epsilon)
+                w = (w * f).astype(w.dtype)
+                b = ((b - self.eval_keras(l.moving_mean)) * f + beta).astype(b.dtype)
+            else:
+                relu = True
+        cur_node = Conv2DNode(w, b, strides, padding, prev_node, relu=relu, parallel=self.parallel)
+        if not relu:
+            cur_node = self.add_activation(layer.activation, cur_node)
         if self.testing != 0:
-            cur_node = self.add_test_node(cur_node, layer)
+            # Compare with the output of the last layer calculated here.
+            cur_node = self.add_test_node(cur_node, ([layer] + fused_layers)[-1])
         return cur_node
 
     def write_c(self, path):
@@ -396,8 +536,8 @@ class NNCG:
         :param prev_node: The previous node.
         :return: The NNCG DenseNode.
         """
-        w = K.eval(layer.weights[0])
-        b = K.eval(layer.bias)
+        w = self.eval_keras(layer.weights[0])
+        b = self.eval_keras(layer.bias)
         activation = layer.activation
         cur_node = DenseNode(w, b, prev_node)
         cur_node = self.add_activation(activation, cur_node)
@@ -426,12 +566,42 @@ class NNCG:
             func = None
             name = 'input'
         else:
-            func = K.function([self.model.input, K.learning_phase()], [layer.output])
+            func = self.get_keras_function([layer])
             name = layer.name
         n = KerasLayerNode(prev_node, func, name)
         self.test_nodes.append(n)
+        self.test_layers.append(layer)
         return n
 
+    def get_keras_function(self, layers):
+        """
+        Get a Keras function calculating the outputs of the given layers of the current model. Functions are
+        created only once per model.
+        :param layers: List of Keras layers.
+        :return: The function, it takes [input, learning_phase] and returns a list with the output of each layer.
+        """
+        key = tuple(l.name for l in layers)
+        func = self.keras_functions.get(key)
+        if func is None:
+            # Fetching the outputs directly fails for some combinations, e.g. a convolution followed by a leaky
+            # ReLU, as TensorFlow fuses them and the fetched tensor is no longer in the graph. Identities keep them.
+            func = K.function([self.model.input, K.learning_phase()], [tf.identity(l.output) for l in layers])
+            self.keras_functions[key] = func
+        return func
+
+    def eval_keras(self, tensor):
+        """
+        Evaluate a Keras tensor of the current model, e.g. weights. Each tensor is evaluated only once per
+        keras_compile() call or, with reuse_weights, once per model.
+        :param tensor: The tensor.
+        :return: The value as ndarray.
+        """
+        value = self.keras_values.get(tensor.name)
+        if value is None:
+            value = K.eval(tensor)
+            self.keras_values[tensor.name] = value
+        return value
+
     def abstract_to_c(self):
         """
         Lower the global graph to nodes that can be expressed in C. Can only be applied after adding the Keras nodes
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from nncg.nodes.arithmetic import Optimization
+from nncg.nodes.expressions import Variable
+from nncg.nodes.misc import Node
+from nncg.nodes.cnn import DenseNode
+from nncg.nodes.language import CHeaderNode
+
+
+class CBlasDense(Node, Optimization):
+    """
+    Node computing the matrix vector product of a DenseNode with the BLAS function cblas_sgemv(), e.g. provided by
+    OpenBLAS or MKL. The weights given by Keras are a row major K x N matrix (channels in x channels out), so the
+    output is the transposed matrix multiplied with the input. The output must already hold the bias which is
+    added with beta = 1.
+    """
+    snippet = 'cblas_sgemv(CblasRowMajor, CblasTrans, {K}, {N}, 1.0f, (const float *){w}, {N}, ' \
+              '(const float *){x}, 1, 1.0f, (float *){y}, 1);\n'
+
+    def __init__(self, y: Variable, x: Variable, w: Variable, K, N, prev_node=None, name='next'):
+        """
+        Init the Node.
+        :param y: The output Variable with N values, initialized with the bias.
+        :param x: The input Variable with K values.
+        :param w: The weights as K x N matrix.
+        :param K: Number of input channels.
+        :param N: Number of output channels.
+        :param prev_node: The previous node.
+        :param name: Connects to the previous node with an edge with this name.
+        """
+        super().__init__(prev_node, name)
+        self.add_edge('y', y, 'var')
+        self.add_edge('x', x, 'var')
+        self.add_edge('w', w, 'var')
+        self.K = K
+        self.N = N
+
+    @classmethod
+    def applicable(cls, other: DenseNode):
+        """
+        Determine if a DenseNode can be calculated by BLAS. It must already be lowered, data types must be float and
+        input and output must not be padded as BLAS expects contiguous vectors.
+        :param other: The DenseNode.
+        :return: True or False.
+        """
+        if getattr(other, 'w_var', None) is None:
+            return False
+        for v in [other.w_var, other.in_var, other.out_var]:
+            if str(v.get_type())[0:5] != 'float':
+                return False
+            if v.pads is not None and any(p != [0, 0] for p in v.pads):
+                return False
+        return True
+
+    @classmethod
+    def apply(cls, root_node: DenseNode):
+        """
+        Replace the loops of the multiplication in the lowered DenseNode with this node. The loop assigning the bias
+        to the output stays.
+        :param root_node: The DenseNode.
+        :return: None.
+        """
+        d = root_node
+        b_loop = d.get_node('content')
+        b_loop.edges['next'].remove()
+        cls(d.out_var, d.in_var, d.w_var, d.in_dim, d.out_dim, b_loop)
+        CHeaderNode.instance().blas_required = True
@@ -17,7 +17,8 @@ class Conv2DNode(Node):
     out_var: Variable
     access_pattern: List[int]
 
-    def __init__(self, w: np.ndarray, b: np.ndarray, stride: tuple, padding: str, prev_node):
+    def __init__(self, w: np.ndarray, b: np.ndarray, stride: tuple, padding: str, prev_node, relu=False,
+                 parallel=False):
         """
         Initialize the Conv2DNode.
         :param w: Weights. Shape must be: kernel height, kernel width, channels in, channels out (number of filter)
@@ -26,6 +27,8 @@ class Conv2DNode(Node):
         :param stride: Tuple of 2.
         :param padding: Like in TensorFlow 'same' or 'valid'
         :param prev_node: The previous node.
+        :param relu: Apply a ReLU to the output? Saves a separate LeakyReLUNode with its own output.
+        :param parallel: Calculate the output rows in parallel using OpenMP?
         """
         self.in_var = prev_node.out_var
         x = self.in_var
@@ -37,6 +40,8 @@ class Conv2DNode(Node):
         self.b = b
         self.stride = stride
         self.padding = padding
+        self.relu = relu
+        self.parallel = parallel
         self.H, self.W, self.C_IN = x.dim
         self.KH, self.KW, _, self.C_OUT = w.shape
         self.SH, self.SW = stride
@@ -87,27 +92,35 @@ class Conv2DNode(Node):
 
         set_bias = AssignmentNode(out_var_idx, b_var_idx)
         b_c_loop.add_edge('content', set_bias)
+        b_c_loop.simd = True
         out_var_idx.set_indices([b_h_loop.get_node('var'), b_w_loop.get_node('var'), b_c_loop.get_node('var')])
         b_var_idx.set_indices([b_c_loop.get_node('var')])
 
-        # Create the loops for convolution, again with descriptors
+        # Create the loops for convolution, again with descriptors. Loops over a filter dimension of size 1 are
+        # omitted, so a 1x1 convolution is a plain matrix multiplication over the channels of each pixel.
         conv_loop_descr = [
             [0, self.out_dim[0] * self.SH, self.stride[0]],
-            [0, self.out_dim[1] * self.SW, self.stride[1]],
-            [0, self.KH, 1],
-            [0, self.KW, 1],
+            [0, self.out_dim[1] * self.SW, self.stride[1]]
+        ]
+        if self.KH > 1:
+            conv_loop_descr.append([0, self.KH, 1])
+        if self.KW > 1:
+            conv_loop_descr.append([0, self.KW, 1])
+        conv_loop_descr += [
             [0, self.C_IN, 1],
             [0, self.C_OUT, 1]
         ]
         conv_loops = LoopNode.create_loops_by_description(conv_loop_descr)
         h_loop = conv_loops[0]
         w_loop = conv_loops[1]
-        kh_loop = conv_loops[2]
-        kw_loop = conv_loops[3]
-        c_in_loop = conv_loops[4]
-        c_out_loop = conv_loops[5]
+        c_in_loop = conv_loops[-2]
+        c_out_loop = conv_loops[-1]
+        filter_loops = conv_loops[2:-2]
+        kh_var = filter_loops[0].get_node('var') if self.KH > 1 else Constant.get(0)
+        kw_var = filter_loops[-1].get_node('var') if self.KW > 1 else Constant.get(0)
 
         b_h_loop.add_edge('next', h_loop)
+        h_loop.parallel = self.parallel
 
         w_var = Allocation.allocate_var(self.w.dtype, 'w', self.w.shape, init_data=self.w)
         out_var_idx = IndexedVariable(self.out_var)
@@ -117,29 +130,43 @@ class Conv2DNode(Node):
         # Indices of IndexedVariables must respect the stride
         exp1 = Expression('{var} / {stride0}',
                           var=h_loop.get_node('var'),
-                          stride0=Constant(self.stride[0]))
+                          stride0=Constant.get(self.stride[0]))
         exp2 = Expression('{var} / {stride1}',
                           var=w_loop.get_node('var'),
-                          stride1=Constant(self.stride[1]))
+                          stride1=Constant.get(self.stride[1]))
         # And access to the image start at the upper left corner. But we have to add the current offset of the filter.
         exp3 = Expression('{var1} + {var2}',
                           var1=h_loop.get_node('var'),
-                          var2=kh_loop.get_node('var'))
+                          var2=kh_var) if self.KH > 1 else h_loop.get_node('var')
         exp4 = Expression('{var1} + {var2}',
                           var1=w_loop.get_node('var'),
-                          var2=kw_loop.get_node('var'))
+                          var2=kw_var) if self.KW > 1 else w_loop.get_node('var')
         out_var_idx.set_indices([exp1, exp2, c_out_loop.get_node('var')])
         in_var_idx.set_indices([exp3, exp4, c_in_loop.get_node('var')])
         w_var_idx.set_indices(
-            [kh_loop.get_node('var'), kw_loop.get_node('var'), c_in_loop.get_node('var'), c_out_loop.get_node('var')])
+            [kh_var, kw_var, c_in_loop.get_node('var'), c_out_loop.get_node('var')])
         mac_node = MACNode(out_var_idx, w_var_idx, in_var_idx)
         c_out_loop.add_edge('content', mac_node)
+        c_out_loop.simd = True
+
+        # A fused ReLU is applied in place after the convolution.
+        if self.relu:
+            relu_loops, idxs = LoopNode.create_loops(self.out_var.dim)
+            out_var_idx = IndexedVariable(self.out_var)
+            out_var_idx.set_indices(idxs)
+            condition = Expression('{t_var_idx} < 0', t_var_idx=out_var_idx)
+            relu_loops[-1].add_edge('content', ConditionalNode(out_var_idx, condition, Constant.get(0), out_var_idx))
+            h_loop.add_edge('next', relu_loops[0])
 
         # These variables must be declared (partially with initial data) at the beginning of the function
         self.var_decls.append(self.out_var)
         self.const_decls.append(w_var)
         self.const_decls.append(b_var)
 
+        # Keep them for optimizations replacing the content.
+        self.w_var = w_var
+        self.b_var = b_var
+
         # Don't remove this node, just put everything as content to this node.
         self.add_edge('content', b_h_loop)
 
@@ -149,12 +176,15 @@ class Conv2DNode(Node):
         :param x_scale: A factor previously determined by quantize_scale() for scaling the weights. Used for bias here.
         :return: None.
         """
-        min = np.min([np.min(self.w), np.min(self.b)])
-        max = np.max([np.max(self.w), np.max(self.b)])
-        self.scale = QuantizedNode.quantize_scale(min, max, 'int8')
-        self.w = (self.w / self.scale).astype('int8')
-        self.b = (self.b / self.scale / x_scale).astype('int16')
-        #self.out_var.type = 'int'
+        # Symmetric quantization of the weights to int8. The bias is added to the accumulator and thus gets the
+        # scale of the products, int32 is required to not lose its range.
+        self.scale = QuantizedNode.quantize_scale(np.min(self.w), np.max(self.w), 'int8')
+        self.w = np.clip(np.round(self.w / self.scale), -127, 127).astype('int8')
+        self.b = np.round(self.b / self.scale / x_scale).astype('int32')
+
+        # The products are accumulated in int32, so the output is int32 and must be dequantized afterwards.
+        self.out_var = Allocation.allocate_var('int32', 'x', self.out_dim)
+        self.out_var.scale = self.scale * x_scale
 
 
 class LeakyReLUNode(Node):
@@ -189,9 +219,9 @@ class LeakyReLUNode(Node):
         out_var_idx.set_indices(idxs)
         condition = Expression('{t_var_idx} < 0', t_var_idx=in_var_idx)
         if self.alpha == 0:
-            false_exp = Constant(0)
+            false_exp = Constant.get(0)
         else:
-            false_exp = Expression('{alpha} * {t_var_idx}', t_var_idx=in_var_idx)
+            false_exp = Expression('{alpha} * {t_var_idx}', alpha=Constant.get(self.alpha), t_var_idx=in_var_idx)
         cond_node = ConditionalNode(out_var_idx, condition, false_exp, in_var_idx)
         loops[-1].add_edge('content', cond_node)
         self.var_decls.append(self.out_var)
@@ -257,11 +287,17 @@ class DenseNode(Node):
         b_loop.add_edge('next', in_loop)
         in_loop.add_edge('content', out_loop)
         out_loop.add_edge('content', mac_node)
+        out_loop.simd = True
+        b_loop.simd = True
 
         self.var_decls.append(self.out_var)
         self.const_decls.append(w_var)
         self.const_decls.append(b_var)
 
+        # Keep them for optimizations replacing the content.
+        self.w_var = w_var
+        self.b_var = b_var
+
         # Meta data not required yet so remove this node
         self.add_edge('content', b_loop)
 
@@ -331,8 +367,8 @@ class MaxPoolingNode(Node):
         c_loop = LoopNode(self.in_dim[2])
         w_loop.add_edge('content', c_loop)
 
-        exp1 = Expression('{var} / {stride0}', var=h_loop.get_node('var'), stride0=Constant(self.stride[0]))
-        exp2 = Expression('{var} / {stride1}', var=w_loop.get_node('var'), stride1=Constant(self.stride[1]))
+        exp1 = Expression('{var} / {stride0}', var=h_loop.get_node('var'), stride0=Constant.get(self.stride[0]))
+        exp2 = Expression('{var} / {stride1}', var=w_loop.get_node('var'), stride1=Constant.get(self.stride[1]))
         out_var_idx = IndexedVariable(self.out_var)
         in_var_idx = IndexedVariable(self.in_var, False)
         out_var_idx.set_indices([exp1, exp2, c_loop.get_node('var')])
@@ -446,7 +482,7 @@ class MeanNode(Node):
         """
         out_idx_var = IndexedVariable(self.out_var)
         in_idx_var = IndexedVariable(self.in_var)
-        sub_node = SubNode(out_idx_var, in_idx_var, Constant(self.mean))
+        sub_node = SubNode(out_idx_var, in_idx_var, Constant.get(self.mean))
         n = sub_node
         count_vars = []
         for d in reversed(self.out_dim):
@@ -7,7 +7,7 @@ from nncg.nodes.expressions import *
 from nncg.nodes.misc import Node, AlternativesNode
 from nncg.traverse.actions.replaceexpression import ReplaceExpression
 from nncg.traverse.actions.deepcopy import DeepCopyLoop
-from nncg.traverse.actions.searchnode import SearchNodeByName
+from nncg.traverse.actions.searchnode import SearchNode, SearchNodeByType
 from nncg.traverse.actions.deepcopy import DeepCopy
 from nncg.writer import Writer
 
@@ -20,7 +20,9 @@ class LoopNode(Node):
     """
     content: Node
 
-    snippet = 'for ({type} {var} = {start}; {var} < {stop}; {var} += {step}) {{\n'
+    snippet = '{pragma}for ({type} {var} = {start}; {var} < {stop}; {var} += {step}) {{\n'
+    simd_pragma = '#pragma GCC ivdep\n'
+    parallel_pragma = '#pragma omp parallel for schedule(static)\n'
     var: Variable
 
     @staticmethod
@@ -88,8 +90,9 @@ class LoopNode(Node):
             temporal_values.append(l.start)
 
         # Collect all count variables in the loops that are not used in the IndexVariable. These can be ignored.
+        # Indices reference the loop variables itself, so search for the instance and not for its name.
         for v in loop_vars:
-            action = SearchNodeByName(str(v))
+            action = SearchNode(v)
             var.traverse(action)
             if action.result == []:
                 ignore.append(v)
@@ -152,6 +155,11 @@ class LoopNode(Node):
         if content is not None:
             self.add_edge('content', content)
         self.type = 'int'
+        # Set if the iterations are independent. Then the compiler is told to vectorize it if it is innermost.
+        self.simd = False
+        # Set to distribute the iterations to threads by OpenMP. Everything written in one iteration must be
+        # independent of all other iterations.
+        self.parallel = False
         var = Allocation.allocate_var(self.type, var_name, [])
         self.add_edge('var', var)
 
@@ -243,6 +251,12 @@ class LoopNode(Node):
         the content before next.
         :return: None.
         """
+        if self.parallel:
+            self.pragma = self.parallel_pragma
+        elif self.simd and self.is_innermost():
+            self.pragma = self.simd_pragma
+        else:
+            self.pragma = ''
         _exp = self.snippet.format(**self.__dict__, **self.edges)
         Writer.write_c(_exp)
         Writer.cur_depth += 1
@@ -256,6 +270,17 @@ class LoopNode(Node):
         Writer.cur_depth -= 1
         Writer.write_c('}\n')
 
+    def is_innermost(self) -> bool:
+        """
+        Is this loop an innermost loop, i.e. does its content not contain further loops?
+        :return: True or False.
+        """
+        content = self.get_node('content')
+        search = SearchNodeByType(LoopNode)
+        search.traverse_edges = ['content', 'next']
+        content.traverse(search)
+        return type(content) is not LoopNode and len(search.result) == 0
+
     def get_deep_length(self):
         """
         How many nested loops follow?
@@ -1,8 +1,9 @@
 from __future__ import annotations
 from typing import List, Dict, Optional
+from string import Formatter
 import numpy as np
 from nncg.tools import _len
-from nncg.traverse.tree import TreeNode
+from nncg.traverse.tree import TreeNode, Edge
 
 
 class Expression(TreeNode):
@@ -10,7 +11,6 @@ class Expression(TreeNode):
     Node to express a general expression. It is usually used as part of Arithmetic oder meta
     nodes.
     """
-    snippet = ''
 
     def __init__(self, snippet, **kwargs):
         """
@@ -24,19 +24,76 @@ class Expression(TreeNode):
         self.snippet = snippet
         for a in kwargs:
             self.add_edge(a, kwargs[a], 'm_expr')
+        self.str_cache = (None, '')
 
     def __str__(self):
         """
-        Returns this Expression as a string.
+        Returns this Expression as a string. The string is cached as long as the graph is not changed.
         :return: The string.
         """
-        return self.snippet.format(**self.edges)
+        if self.str_cache[0] != TreeNode.modifications:
+            edges = self.edges
+            self.str_cache = (TreeNode.modifications, ''.join([literal if name is None
+                                                               else literal + str(edges[name].target)
+                                                               for literal, name in self.segments]))
+        return self.str_cache[1]
+
+    @property
+    def snippet(self):
+        """
+        The C code snippet of this Expression.
+        :return: The snippet.
+        """
+        return self._snippet
+
+    @snippet.setter
+    def snippet(self, snippet):
+        """
+        Set the snippet. It is parsed once into segments of literal text, each followed by the name of the
+        Edge to insert (None for the last one), so that building the string does not need str.format().
+        :param snippet: The snippet, only names without format specification are supported in {}.
+        :return: None.
+        """
+        self._snippet = snippet
+        self.segments = []
+        for literal, name, spec, conversion in Formatter().parse(snippet):
+            assert not spec and conversion is None
+            self.segments.append((literal, name))
+        TreeNode.modifications += 1
+
+    def fold_constants(self):
+        """
+        Partial evaluation of this Expression once the graph is final. Constants and Expressions without further
+        Edges are written as literals into the snippet and their Edges are removed. A trailing multiplication or
+        division by 1, e.g. {var} / 1 for a stride of 1, is dropped. As * and / bind strongest, this does not
+        change the value of an Expression embedded into another one.
+        :return: None.
+        """
+        folded = [name for name, e in self.edges.items() if e.n_type == 'm_expr' and
+                  (type(e.target) is Constant or (type(e.target) is Expression and not e.target.not_inverse_edges()))]
+        if not folded:
+            return
+        snippet = ''
+        for literal, name in self.segments:
+            snippet += literal.replace('{', '{{').replace('}', '}}')
+            if name in folded:
+                snippet += str(self.edges[name].target).replace('{', '{{').replace('}', '}}')
+            elif name is not None:
+                snippet += '{' + name + '}'
+        for name in folded:
+            self.remove_edge(name)
+        if snippet.endswith((' / 1', ' * 1')):
+            snippet = snippet[:-4]
+        self.snippet = snippet
 
 
 class Constant(TreeNode):
     """
     Simple node just representing a constant.
     """
+    shared = False
+    _instances: Dict = {}
+
     def __init__(self, c):
         """
         Init this node.
@@ -45,6 +102,34 @@ class Constant(TreeNode):
         super().__init__()
         self.c = c
 
+    @staticmethod
+    def get(c) -> Constant:
+        """
+        Get a shared Constant for this value. The lowering of each layer uses many constants like 0 or strides, so
+        instead of a new node for every index one node per value is used.
+        :param c: The value, if it is not hashable a new Constant is returned.
+        :return: The Constant.
+        """
+        try:
+            key = (type(c), c)
+            n = Constant._instances.get(key)
+        except TypeError:
+            return Constant(c)
+        if n is None:
+            n = Constant(c)
+            n.shared = True
+            Constant._instances[key] = n
+        return n
+
+    def add_edge(self, name, target: TreeNode, n_type='forward', inverse=None, replace=False) -> Edge:
+        """
+        See TreeNode.add_edge(). A shared Constant does not store the inverse Edges to its countless users. They are
+        still created for the Edges pointing to this node.
+        """
+        if self.shared and n_type == 'inverse':
+            return Edge(name, target, self, n_type, inverse)
+        return super().add_edge(name, target, n_type, inverse, replace)
+
     def __str__(self):
         """
         Get this Constant as a string.
@@ -75,6 +160,7 @@ class Variable(TreeNode):
     alignment: str
     pads: List[List[int]] = None
     init_data: None
+    scale: float
 
     def __init__(self,
                  type: str,
@@ -99,8 +185,14 @@ class Variable(TreeNode):
         self.dim = dim
         self.set_alignment(alignment)
         self.init_data = init_data
-        self.pads = _len(dim) * [[0, 0]]
-        self.temporal_value = None
+        if init_data is not None and str(type) == 'float64':
+            # The data is converted to float32, see init_data.
+            self.type = 'float32'
+        self.pads = [[0, 0] for _ in range(_len(dim))]
+        self._temporal_value = None
+
+        # Quantization parameter, a stored value q represents the real value scale * q.
+        self.scale = 1.0
 
     @staticmethod
     def type_to_c(t) -> str:
@@ -116,6 +208,7 @@ class Variable(TreeNode):
             'int8': 'int8_t',
             'uint8': 'unsigned char',
             'int16': 'int16_t',
+            'int32': 'int32_t',
             '__m128i': '__m128i',
             'int': 'int'
         }
@@ -135,10 +228,70 @@ class Variable(TreeNode):
             'int8': 8,
             'uint8': 8,
             'int16': 16,
+            'int32': 32,
             'int': 32
         }
         return width_map[str(t)]
 
+    @property
+    def dim(self):
+        """
+        The dimensions of the array or None if it is no array.
+        :return: The dimensions.
+        """
+        return self._dim
+
+    @dim.setter
+    def dim(self, dim):
+        """
+        Set the dimensions, e.g. after transposing.
+        :param dim: The new dimensions.
+        :return: None.
+        """
+        self._dim = dim
+        self._dim_str = None
+
+    @property
+    def init_data(self):
+        """
+        The initial data or None.
+        :return: The data.
+        """
+        return self._init_data
+
+    @init_data.setter
+    def init_data(self, data):
+        """
+        Set the initial data, e.g. again after transposing. It is stored contiguous as it is written as a block.
+        Floating point data is stored as float32 as the CNN calculates in float32, e.g. float64 biases would
+        just double the size of the weights.
+        :param data: The data or None.
+        :return: None.
+        """
+        if data is not None:
+            data = np.asarray(data)
+            data = np.ascontiguousarray(data, dtype=np.float32 if data.dtype.kind == 'f' else data.dtype)
+        self._init_data = data
+
+    @property
+    def temporal_value(self):
+        """
+        A value temporarily replacing this Variable when converted to a string, e.g. to evaluate index expressions
+        for a specific loop iteration.
+        :return: The value or None.
+        """
+        return self._temporal_value
+
+    @temporal_value.setter
+    def temporal_value(self, value):
+        """
+        Set the temporal value. This changes the strings of all nodes using this Variable.
+        :param value: The value or None.
+        :return: None.
+        """
+        self._temporal_value = value
+        TreeNode.modifications += 1
+
     def __str__(self):
         """
         Get name of Variable (including unique number).
@@ -156,6 +309,8 @@ class Variable(TreeNode):
         """
         assert len(pads) == _len(self.dim)
         self.pads = pads
+        self._dim_str = None
+        TreeNode.modifications += 1
 
     def get_cast(self):
         """
@@ -173,29 +328,34 @@ class Variable(TreeNode):
 
     def _get_dim_str(self):
         """
-        Get the string for defining an array.
+        Get the string for defining an array. It is cached until the dimensions or the padding change.
         :return: The string.
         """
-        if self.dim is None:
-            return ''
-        return ''.join(['[' + str(i + j[0] + j[1]) + ']' for i, j in zip(np.atleast_1d(self.dim), self.pads)])
+        if self._dim_str is None:
+            if self._dim is None:
+                self._dim_str = ''
+            else:
+                self._dim_str = ''.join(['[{}]'.format(d + p[0] + p[1])
+                                         for d, p in zip(np.atleast_1d(self._dim), self.pads)])
+        return self._dim_str
 
     @staticmethod
-    def format_value(v, dtype: np.dtype):
+    def format_values(data: np.ndarray) -> str:
         '''
-        Give a string for writing this value.
-        :param v: The value.
-        :param dtype: The datatype of the value.
+        Give a comma separated string of all values for writing them into the C file. All values are formatted by
+        a single format operation instead of formatting each value separately. 9 significant digits are enough to
+        restore each float32 exactly.
+        :param data: The values.
         :return: The formatted string.
         '''
-        if dtype == 'float32':
-            return np.format_float_scientific(v, precision=15)
-        elif dtype == 'int8':
-            return str(v)
-        elif dtype == 'int16':
-            return str(v)
+        if data.dtype == 'float32':
+            fmt = '%.9g'
+        elif data.dtype in ['int8', 'uint8', 'int16', 'int32']:
+            fmt = '%d'
         else:
             raise Exception("Unknown data type.")
+        values = data.ravel().tolist()
+        return ','.join([fmt] * len(values)) % tuple(values)
 
     def get_def(self, write_init_data=True):
         """
@@ -207,13 +367,22 @@ class Variable(TreeNode):
             return
         self.dim_str = self._get_dim_str()
         if self.init_data is not None and write_init_data:
-            self.data_str = ','.join([Variable.format_value(f, self.init_data.dtype)
-                                      for f in (self.init_data.flatten())])
+            self.data_str = Variable.format_values(self.init_data)
         else:
             self.data_str = '0'
         self.var_type = Variable.type_to_c(self.type)
         return 'static {var_type} {name}_{index} {alignment} {dim_str} = {{ {data_str} }};\n'.format(**self.__dict__)
 
+    def get_local_decl(self):
+        """
+        Get the string to declare this Variable without static and initialization, e.g. within a loop
+        to have an own instance per thread.
+        :return: The declaration.
+        """
+        self.dim_str = self._get_dim_str()
+        self.var_type = Variable.type_to_c(self.type)
+        return '{var_type} {name}_{index} {alignment} {dim_str};\n'.format(**self.__dict__)
+
     def get_pointer_decl(self):
         """
         This returns a string to declare this Variable as a pointer.
@@ -248,6 +417,7 @@ class IndexedVariable(TreeNode):
         super().__init__()
         self.add_edge('var', var)
         self.padding_to_offset = padding_to_offset
+        self.str_cache = (None, '')
 
     def get_type(self):
         """
@@ -283,14 +453,25 @@ class IndexedVariable(TreeNode):
 
     def __str__(self):
         """
-        Get the string with Variable and indices.
+        Get the string with Variable and indices. The string is cached as long as the graph is not changed.
+        :return: The string.
+        """
+        if self.str_cache[0] != TreeNode.modifications:
+            self.str_cache = (TreeNode.modifications, self._get_str())
+        return self.str_cache[1]
+
+    def _get_str(self):
+        """
+        Build the string with Variable and indices.
         :return: The string.
         """
-        s = str(self.get_node('var'))
-        n = self.get_node_by_type('index')
-        for i in n:
+        var = self.get_node('var')
+        pads = var.pads
+        s = str(var)
+        # The position is required for the padding, the same (shared) node may be used for different indices.
+        for pos, i in enumerate(self.get_node_by_type('index')):
             s += '[' + str(i)
-            if self.padding_to_offset:
-                s += ' + ' + str(self.get_node('var').pads[n.index(i)][0])
+            if self.padding_to_offset and pads[pos][0] != 0:
+                s += ' + ' + str(pads[pos][0])
             s += ']'
         return s
@@ -0,0 +1,304 @@
+from __future__ import annotations
+from nncg.nodes.arithmetic import AssignmentNode, Optimization
+from nncg.nodes.controlflow import LoopNode
+from nncg.nodes.expressions import IndexedVariable, Expression, Constant, Variable
+from nncg.nodes.misc import Node, ExpressionNode
+from nncg.nodes.cnn import Conv2DNode
+from nncg.nodes.language import CHeaderNode
+from nncg.allocation import Allocation
+
+
+class Im2ColConv(Node, Optimization):
+    """
+    Node computing one output row of a Conv2DNode as matrix multiplication using SSE3. Before, the input of that
+    row is rearranged by im2col into a buffer of W_OUT columns with K = KH * KW * C_IN values each. As features are
+    stored in HWC format this is a copy of C_IN consecutive floats per filter tap and the weights given by Keras
+    (KH x KW x C_IN x C_OUT) already are a K x C_OUT matrix. Comparable to the register tiles of CMSIS-NN, a tile of
+    output pixels and vectors of output channels is accumulated in registers per inner iteration so that every
+    loaded weight and input is used multiple times. Additionally K is split into blocks and the weights of a block
+    for one tile of output channels are used for all pixels of the row before continuing with the next.
+    """
+    lanes = 4
+    tile_pixels = 2   # Output pixels per tile.
+    tile_vectors = 4  # Vectors of output channels per tile, 2 x 4 accumulators leave registers for the operands.
+    k_block = 256     # Length of the blocks of K, the weights of a block for one tile (16 KB) stay in the L1 cache.
+    alignment = 2     # Required alignment of the vectors for Variable.set_alignment()
+    vec_type = '__m128'
+    load = '_mm_load_ps'
+    load1 = '_mm_load_ps1'
+    store = '_mm_store_ps'
+    maximum = '_mm_max_ps'
+    setzero = '_mm_setzero_ps'
+
+    def __init__(self, out_row: IndexedVariable, x_row: IndexedVariable, w: Variable, b: Variable,
+                 W_OUT, K, C_OUT, relu=False, prev_node=None, name='next'):
+        """
+        Init the Node. Immediately creates the C code as this node is applied after general lowering.
+        :param out_row: IndexedVariable pointing to the first element of the output row.
+        :param x_row: IndexedVariable pointing to the first element of the im2col buffer.
+        :param w: The weights as K x C_OUT matrix.
+        :param b: The bias.
+        :param W_OUT: Output pixels in this row.
+        :param K: Length of a column, i.e. KH * KW * C_IN.
+        :param C_OUT: Number of output channels.
+        :param relu: Apply a ReLU to the accumulators before storing them?
+        :param prev_node: The previous node.
+        :param name: Connects to the previous node with an edge with this name.
+        """
+        super().__init__(prev_node, name)
+        self.add_edge('out_row', out_row, 'var')
+        self.add_edge('x_row', x_row, 'var')
+        self.add_edge('w', w, 'var')
+        self.add_edge('b', b, 'var')
+        self.W_OUT = W_OUT
+        self.K = K
+        self.C_OUT = C_OUT
+        self.relu = relu
+        self.snippet = self._gen_snippet()
+
+    def _mac(self, acc, w, x):
+        """
+        C code for acc += w * x on vector registers.
+        :param acc: Name of the accumulator.
+        :param w: Name of the register holding the weights.
+        :param x: Name of the register holding the broadcast input.
+        :return: The C code.
+        """
+        return '{acc} = _mm_add_ps({acc}, _mm_mul_ps({w}, {x}));'.format(acc=acc, w=w, x=x)
+
+    @staticmethod
+    def _indent(code):
+        """
+        Indent C code by one level.
+        :param code: The C code, each line terminated by a newline.
+        :return: The indented C code.
+        """
+        return '    ' + code.replace('\n', '\n    ')[:-4]
+
+    def _gen_tile(self, pixels, vectors):
+        """
+        Generate C code calculating a tile of output pixels x vectors of output channels for the current block of
+        K. Expects the first pixel in p, the first output channel in oc and the block in k0 to k1. The accumulators
+        start with the bias for the first block and with the stored result of the previous block otherwise.
+        :param pixels: Number of pixels in this tile.
+        :param vectors: Number of vectors in this tile, each has lanes output channels.
+        :return: The C code.
+        """
+        l = self.lanes
+        acc = [['acc{}{}'.format(i, j) for j in range(vectors)] for i in range(pixels)]
+        code = '{\n'
+        for i in range(pixels):
+            code += '    const float *ap{i} = k0 == 0 ? gemm_b + oc : gemm_y + (p + {i}) * {C_OUT} + oc;\n'.format(
+                i=i, C_OUT=self.C_OUT)
+            code += '    {} {};\n'.format(self.vec_type, ', '.join(
+                '{} = {}(ap{} + {})'.format(acc[i][j], self.load, i, j * l) for j in range(vectors)))
+            code += '    const float *xp{i} = gemm_x + (p + {i}) * {K};\n'.format(i=i, K=self.K)
+        code += '    const float *wp = gemm_w + k0 * {} + oc;\n'.format(self.C_OUT)
+        code += '    for (int k = k0; k < k1; k++) {\n'
+        code += '        {} {};\n'.format(self.vec_type, ', '.join(
+            'vw{} = {}(wp + {})'.format(j, self.load, j * l) for j in range(vectors)))
+        code += '        {} {};\n'.format(self.vec_type, ', '.join(
+            'vx{i} = {load1}(xp{i} + k)'.format(i=i, load1=self.load1) for i in range(pixels)))
+        for i in range(pixels):
+            for j in range(vectors):
+                code += '        ' + self._mac(acc[i][j], 'vw{}'.format(j), 'vx{}'.format(i)) + '\n'
+        code += '        wp += {};\n'.format(self.C_OUT)
+        code += '    }\n'
+        if self.relu:
+            code += '    if (k1 == {}) {{\n'.format(self.K)
+            for i in range(pixels):
+                for j in range(vectors):
+                    code += '        {acc} = {maximum}({acc}, {zero}());\n'.format(acc=acc[i][j],
+                                                                               maximum=self.maximum,
+                                                                               zero=self.setzero)
+            code += '    }\n'
+        for i in range(pixels):
+            for j in range(vectors):
+                code += '    {}(gemm_y + (p + {}) * {} + oc + {}, {});\n'.format(self.store, i, self.C_OUT, j * l,
+                                                                             acc[i][j])
+        code += '}\n'
+        return code
+
+    def _gen_p_loop(self, vectors):
+        """
+        Generate the loop over all pixels of the row for a given number of vectors of output channels.
+        :param vectors: Number of vectors calculated at once.
+        :return: The C code.
+        """
+        step = self.tile_pixels
+        end = self.W_OUT - self.W_OUT % step
+        code = ''
+        if end > 0:
+            code += 'for (int p = 0; p < {}; p += {}) '.format(end, step)
+            code += self._gen_tile(step, vectors)
+        if end != self.W_OUT:
+            code += '{{\n    int p = {};\n'.format(end)
+            code += self._indent(self._gen_tile(self.W_OUT - end, vectors))
+            code += '}\n'
+        return code
+
+    def _gen_oc_loop(self):
+        """
+        Generate the loop over all output channels. The weights of a block of K for one tile of output channels
+        are used for all pixels of the row before the next output channels are calculated.
+        :return: The C code.
+        """
+        step = self.tile_vectors * self.lanes
+        end = self.C_OUT - self.C_OUT % step
+        code = ''
+        if end > 0:
+            code += 'for (int oc = 0; oc < {}; oc += {}) {{\n'.format(end, step)
+            code += self._indent(self._gen_p_loop(self.tile_vectors))
+            code += '}\n'
+        if end != self.C_OUT:
+            code += '{{\n    int oc = {};\n'.format(end)
+            code += self._indent(self._gen_p_loop((self.C_OUT - end) // self.lanes))
+            code += '}\n'
+        return code
+
+    def _gen_snippet(self):
+        """
+        Generate the snippet for the complete row. K is split into blocks of k_block.
+        :return: The snippet.
+        """
+        if self.K > self.k_block:
+            code = 'for (int k0 = 0; k0 < {K}; k0 += {KB}) {{\n' \
+                   '    const int k1 = k0 + {KB} < {K} ? k0 + {KB} : {K};\n'.format(K=self.K, KB=self.k_block)
+        else:
+            code = '{{\n    const int k0 = 0, k1 = {};\n'.format(self.K)
+        code += self._indent(self._gen_oc_loop())
+        code += '}\n'
+        code = code.replace('{', '{{').replace('}', '}}')
+        return '''{{
+    float *gemm_y = (float*)&{out_row};
+    const float *gemm_x = (float*)&{x_row};
+    const float *gemm_w = (float*){w};
+    const float *gemm_b = (float*){b};
+''' + self._indent(code) + '}}\n'
+
+    @classmethod
+    def applicable(cls, other: Conv2DNode):
+        """
+        Determine if a Conv2DNode can be replaced by im2col and this node. The Conv2DNode must already be lowered,
+        data types must be float and the output channels must fill complete vectors.
+        :param other: The Conv2DNode.
+        :return: True or False.
+        """
+        if getattr(other, 'w_var', None) is None:
+            return False
+        if other.C_OUT % cls.lanes != 0:
+            return False
+        if str(other.w.dtype)[0:5] != 'float' or str(other.b.dtype)[0:5] != 'float':
+            return False
+        if str(other.in_var.get_type())[0:5] != 'float':
+            return False
+        return True
+
+    @classmethod
+    def apply(cls, root_node: Conv2DNode):
+        """
+        Replace the content of the Conv2DNode with a loop over all output rows. Each iteration first copies the
+        input required for this row into an im2col buffer and then calculates the row with this node. The copy is
+        skipped for 1x1 convolutions with horizontal stride 1 as their input rows are already matrices. The rows
+        are calculated in parallel if the Conv2DNode is marked as parallel. A fused
+        ReLU is applied to the accumulators, so the separate loops of the general lowering are dropped as well.
+        :param root_node: The Conv2DNode.
+        :return: None.
+        """
+        c = root_node
+        H_OUT, W_OUT, _ = c.out_dim
+        K = c.KH * c.KW * c.C_IN
+        h_loop = LoopNode(start=0, stop=H_OUT * c.SH, step=c.SH)
+        h_loop.parallel = c.parallel
+        out_row = IndexedVariable(c.out_var)
+        out_row.set_indices([Expression('{var} / {stride0}', var=h_loop.get_node('var'), stride0=Constant.get(c.SH)),
+                             Constant.get(0), Constant.get(0)])
+
+        if c.KH == 1 and c.KW == 1 and c.SW == 1:
+            # A 1x1 convolution with horizontal stride 1 needs no padding and its input row already is the
+            # W_OUT x C_IN matrix, so the matrix multiplication reads it directly.
+            x_row = IndexedVariable(c.in_var, False)
+            x_row.set_indices([h_loop.get_node('var'), Constant.get(0), Constant.get(0)])
+            cls(out_row, x_row, c.w_var, c.b_var, W_OUT, K, c.C_OUT, c.relu, h_loop, 'content')
+        else:
+            # The im2col loops, copying e.g. x[h + kh][w + kw][c_in] to col[w / SW][kh][kw][c_in]
+            im2col_loop_descr = [
+                [0, W_OUT * c.SW, c.SW],
+                [0, c.KH, 1],
+                [0, c.KW, 1],
+                [0, c.C_IN, 1]
+            ]
+            l = LoopNode.create_loops_by_description(im2col_loop_descr)
+            w_var, kh_var, kw_var, c_in_var = [_l.get_node('var') for _l in l]
+            col_var = Allocation.allocate_var('float', 'col', [W_OUT, c.KH, c.KW, c.C_IN])
+            col_var_idx = IndexedVariable(col_var)
+            in_var_idx = IndexedVariable(c.in_var, False)
+            col_var_idx.set_indices([Expression('{var} / {stride1}', var=w_var, stride1=Constant.get(c.SW)),
+                                     kh_var, kw_var, c_in_var])
+            in_var_idx.set_indices([Expression('{var1} + {var2}', var1=h_loop.get_node('var'), var2=kh_var),
+                                    Expression('{var1} + {var2}', var1=w_var, var2=kw_var),
+                                    c_in_var])
+            l[-1].add_edge('content', AssignmentNode(col_var_idx, in_var_idx))
+            if c.parallel:
+                # Each thread needs its own buffer, so it is declared within the loop over the rows.
+                decl = ExpressionNode(Expression(col_var.get_local_decl()[:-1]))
+                decl.add_edge('next', l[0])
+                h_loop.add_edge('content', decl)
+            else:
+                h_loop.add_edge('content', l[0])
+
+            # The matrix multiplication of the row, the indices point to the beginning of the rows.
+            x_row = IndexedVariable(col_var)
+            x_row.set_indices([Constant.get(0), Constant.get(0), Constant.get(0), Constant.get(0)])
+            gemm = cls(out_row, x_row, c.w_var, c.b_var, W_OUT, K, c.C_OUT, c.relu, l[0])
+            if not c.parallel:
+                gemm.var_decls.append(col_var)
+
+        # Aligned loads and stores are used for bias, weights and output.
+        c.out_var.set_alignment(cls.alignment)
+        c.w_var.set_alignment(cls.alignment)
+        c.b_var.set_alignment(cls.alignment)
+        c.add_edge('content', h_loop, replace=True)
+        CHeaderNode.instance().intel_intr_required = True
+
+
+class Im2ColConvAVX2(Im2ColConv):
+    """
+    Im2ColConv using AVX2 registers with 8 floats. The tile has the same number of vectors, so twice as many output
+    channels, and the blocks of K are halved to keep the weights of a block in the L1 cache.
+    """
+    lanes = 8
+    k_block = 128
+    alignment = 4
+    vec_type = '__m256'
+    load = '_mm256_load_ps'
+    load1 = '_mm256_broadcast_ss'
+    store = '_mm256_store_ps'
+    maximum = '_mm256_max_ps'
+    setzero = '_mm256_setzero_ps'
+
+    def _mac(self, acc, w, x):
+        """
+        C code for acc += w * x on vector registers.
+        :param acc: Name of the accumulator.
+        :param w: Name of the register holding the weights.
+        :param x: Name of the register holding the broadcast input.
+        :return: The C code.
+        """
+        return '{acc} = _mm256_add_ps({acc}, _mm256_mul_ps({w}, {x}));'.format(acc=acc, w=w, x=x)
+
+
+class Im2ColConvAVX2FMA(Im2ColConvAVX2):
+    """
+    Im2ColConvAVX2 using fused multiply-add (FMA3) for the accumulation.
+    """
+
+    def _mac(self, acc, w, x):
+        """
+        C code for acc += w * x on vector registers.
+        :param acc: Name of the accumulator.
+        :param w: Name of the register holding the weights.
+        :param x: Name of the register holding the broadcast input.
+        :return: The C code.
+        """
+        return '{acc} = _mm256_fmadd_ps({w}, {x}, {acc});'.format(acc=acc, w=w, x=x)
@@ -23,6 +23,10 @@ class CHeaderNode(Node):
 
     math_include = '#include <math.h>\n'
 
+    blas_include = '#include <cblas.h>\n'
+
+    openmp_comment = '// Compile with -fopenmp to calculate the convolutions in parallel.\n'
+
     test_include = '''
 #ifdef CNN_TEST
 #include <stdio.h>
@@ -30,42 +34,28 @@ class CHeaderNode(Node):
 
 '''
 
-    # Used to initialize the weights in case it is to large to put them into the C code file.
+    # Used to initialize the weights in case it is to large to put them into the C code file. All weights are
+    # stored in a single binary file in the order they are read.
     weights_init_stdio = '''
 #include <stdio.h>
 
-void init_weight_float(float* w, int len, const char* name)
-{{
-    FILE *f = fopen(name, "rb");
-    fread(w, sizeof(float), len, f);
-    fclose(f);
-}}
-
-void init_weight_int8(int8_t* w, int len, const char* name)
-{{
-    FILE *f = fopen(name, "rb");
-    fread(w, sizeof(int8_t), len, f);
-    fclose(f);
-}}
-
-void init_weight_int16(int16_t* w, int len, const char* name)
-{{
-    FILE *f = fopen(name, "rb");
-    fread(w, sizeof(int16_t), len, f);
-    fclose(f);
-}}
-
 void init_weights()
 {{
-{}
+    FILE *f = fopen("{}", "rb");
+{}    fclose(f);
 }}
 
 '''
 
-    func_def = 'void cnn{id}(float {out_var_name}, float *{scores_var})\n{{\n'
+    # Input and scores must not overlap each other or any variable of the CNN. Telling this the compiler by
+    # __restrict__ allows to vectorize loops accessing them. The input is declared as a pointer to its rows as
+    # C++ does not allow qualifying the array itself, the type is the same.
+    func_def = 'void cnn{id}(float {out_var_name}, float * __restrict__ {scores_var})\n{{\n'
 
     intel_intr_required = False
     math_required = False
+    blas_required = False
+    openmp_required = False
     test_required = True
 
     out_var: Variable = None
@@ -148,7 +138,11 @@ void init_weights()
 
         # Name and definition of the input variable for the C function definition. Variable is call 'out' because
         # it is not only the input but also the output of this layer and following nodes search for 'out_var'.
-        self.out_var_name = str(self.out_var) + ''.join(['[' + str(i) + ']' for i in self.in_dim])
+        self.out_var_name = '(* __restrict__ {})'.format(self.out_var) + ''.join(['[' + str(i) + ']'
+                                                                                  for i in self.in_dim[1:]])
+
+        if self.openmp_required:
+            self.snippet += self.openmp_comment
 
         # Add test code
         if self.test_required:
@@ -158,28 +152,28 @@ void init_weights()
         if self.math_required:
             self.snippet += self.math_include
 
+        # Add header for BLAS
+        if self.blas_required:
+            self.snippet += self.blas_include
+
         # Add header for Intel intrinsics
         if self.intel_intr_required:
             self.snippet += self.intel_intr_includes
 
         # Write all constants, primarily weights including the init data.
+        weights = []
         for v in self.const_decls:
             self.snippet += v.get_def(self.direct).replace('{', '{{').replace('}', '}}')
             if self.stdio:
                 # In this case the weights are later loaded from file.
-                var_type = Variable.type_to_c(v.type)
-                if var_type == 'float':
-                    func_name='init_weight_float'
-                elif var_type == 'int8_t':
-                    func_name = 'init_weight_int8'
-                elif var_type == 'int16_t':
-                    func_name = 'init_weight_int16'
-                else:
-                    assert False
-                weight_snippet += '\t{}(({}*){}, {}, "{}");\n'.format(func_name, var_type, str(v), np.prod(v.dim), str(v))
-                Writer.write_data(v.init_data, str(v))
+                assert v.init_data.nbytes == np.prod(v.dim) * Variable.type_to_width(v.type) // 8
+                weight_snippet += '    fread({}, sizeof({}), 1, f);\n'.format(str(v), str(v))
+                weights.append(v.init_data)
         if self.stdio:
-            self.snippet += self.weights_init_stdio.format(weight_snippet).replace('{', '{{').replace('}', '}}')
+            weights_path = 'cnn{}_weights.bin'.format(self.id)
+            Writer.write_blob(weights, weights_path)
+            self.snippet += self.weights_init_stdio.format(weights_path, weight_snippet).replace('{', '{{').replace(
+                '}', '}}')
         self.snippet += self.func_def
         # Now write all variable definitions. That are primarily the outputs of each layer.
         for v in self.var_decls:
@@ -36,7 +36,7 @@ class Int8SSE3Preprocessing(Node):
         w_idx = l[1].get_node('var')
         c_idx = l[2].get_node('var')
         sse_var_idx.set_indices([h_idx, w_idx, c_idx])
-        an = AssignmentNode(sse_var_idx, Expression('_mm_setzero_ps()'))
+        an = AssignmentNode(sse_var_idx, Expression('_mm_setzero_si128()'))
         l[2].add_edge('content', an)
         self.var_decls.append(self.sse_var)
 
@@ -70,25 +70,17 @@ class Int8SSE3Postprocessing(Node):
         c_idx = l[2].get_node('var')
         sse_var_idx.set_indices([h_idx, w_idx, c_idx])
         res_var_idx.set_indices([h_idx, w_idx, c_idx])
-        lo_var = Allocation.allocate_var('__m128i', 'lo')
-        l1 = AssignmentNode(lo_var, Expression('_mm_srai_epi32(_mm_unpacklo_epi16({qx}, {qx}), 16);', qx=sse_var_idx))
-        hi_var = Allocation.allocate_var('__m128i', 'hi')
-        l2 = AssignmentNode(hi_var, Expression('_mm_srai_epi32(_mm_unpackhi_epi16({qx}, {qx}), 16);', qx=sse_var_idx), l1)
+        # The four int32 partial sums of an output channel are added horizontally.
         sum1_var = Allocation.allocate_var('__m128i', 'sum1')
-        l3 = AssignmentNode(sum1_var, Expression('_mm_hadd_epi32({hi}, {lo});', lo=lo_var, hi=hi_var), l2)
+        l1 = AssignmentNode(sum1_var, Expression('_mm_hadd_epi32({qx}, {qx});', qx=sse_var_idx))
         sum2_var = Allocation.allocate_var('__m128i', 'sum2')
-        l4 = AssignmentNode(sum2_var, Expression('_mm_hadd_epi32({sum1}, {sum1});', sum1=sum1_var), l3)
+        l2 = AssignmentNode(sum2_var, Expression('_mm_hadd_epi32({sum1}, {sum1});', sum1=sum1_var), l1)
         temp_var = Allocation.allocate_var('int', 'temp_res', [4])
-        l5 = FuncCallNode(Expression('_mm_store_si128((__m128i*)&{res}, {sum2});', res=temp_var, sum2=sum2_var), l4)
+        l3 = FuncCallNode(Expression('_mm_store_si128((__m128i*)&{res}, {sum2});', res=temp_var, sum2=sum2_var), l2)
         temp_var_idx_0 = IndexedVariable(temp_var)
-        temp_var_idx_0.set_indices([Constant('0')])
-        temp_var_idx_1 = IndexedVariable(temp_var)
-        temp_var_idx_1.set_indices([Constant('1')])
-        l6 = AddNode(res_var_idx, res_var_idx, temp_var_idx_0, l5)
-        l7 = AddNode(res_var_idx, res_var_idx, temp_var_idx_1, l6)
+        temp_var_idx_0.set_indices([Constant.get('0')])
+        AddNode(res_var_idx, res_var_idx, temp_var_idx_0, l3)
         l[2].add_edge('content', l1)
-        self.var_decls.append(lo_var)
-        self.var_decls.append(hi_var)
         self.var_decls.append(sum1_var)
         self.var_decls.append(sum2_var)
         self.var_decls.append(temp_var)
@@ -96,14 +88,17 @@ class Int8SSE3Postprocessing(Node):
 
 class MACNodeInt8SSE3(MACNode, Optimization):
     """
-    Node for a quad multiply and accumulate for SSE3 CPUs.
+    Node for 16 multiply and accumulate of uint8 inputs and int8 weights for SSSE3 CPUs. PMADDUBSW adds pairs of
+    products to int16, PMADDWD with ones widens to sums of four products in int32 that are accumulated without
+    saturation.
     """
     snippet = '''{{
-    __m128i w, x, y;
+    __m128i w, x;
     x = _mm_lddqu_si128((__m128i*)&{var2});
     w = _mm_lddqu_si128((__m128i*)&{var1});
     x = _mm_maddubs_epi16(x, w);
-    {res_var} = _mm_adds_epi16(x, {res_var});
+    x = _mm_madd_epi16(x, _mm_set1_epi16(1));
+    {res_var} = _mm_add_epi32(x, {res_var});
 }}
 '''
 
@@ -140,8 +140,7 @@ class KerasLayerNode(Node):
     snippet = '''#ifdef CNN_TEST
 {{
     FILE *f = fopen("{var_name}", "wb");
-    for (int i = 0; i < {num}; i++)
-        fprintf(f, "%8.8e\\n", ((float*){var_name})[i]);
+    fwrite((float*){var_name}, sizeof(float), {num}, f);
     fclose(f);
 }} 
 #endif
@@ -173,22 +172,23 @@ class KerasLayerNode(Node):
         self.num = np.prod(self.in_var.dim + np.sum(self.in_var.pads, 1))
         super().write_c()
 
-    def test(self, im, exit_on_err):
+    def test(self, im, exit_on_err, res=None):
         """
         Perform the test using the provided image.
         :param im: The image as 4 dimensional array comparable to Keras.
+        :param exit_on_err: Exit if the results differ?
+        :param res: The output of the Keras layer for this image if already calculated. Otherwise func is executed.
         :return: None.
         """
-        c_res = []
-        with open(self.var_name) as f:
-            for l in f.readlines():
-                c_res.append(float(l))
+        c_res = np.fromfile(self.var_name, dtype=np.float32)
         if self.func is None:
             # E.g. to just check if the input image was loaded correctly.
             res = im.reshape(*im.shape[1:])
-        else:
+        elif res is None:
             # Otherwise execute the Keras function.
             res = np.array(self.func([im, 0])).reshape(self.in_dim)
+        else:
+            res = np.array(res).reshape(self.in_dim)
         c_res = np.array(c_res).reshape(self.in_var.dim + np.sum(self.in_var.pads, 1))
 
         if len(np.atleast_1d(self.in_var.dim)) == 3:
@@ -1,8 +1,8 @@
 from nncg.nodes.misc import Node
 from nncg.nodes.controlflow import LoopNode
 from nncg.allocation import Allocation
-from nncg.nodes.expressions import IndexedVariable, Constant
-from nncg.nodes.arithmetic import MultNode
+from nncg.nodes.expressions import IndexedVariable, Constant, Expression
+from nncg.nodes.arithmetic import MultNode, ConditionalNode
 from nncg.nodes.misc import AlternativesNode
 
 
@@ -23,9 +23,13 @@ class QuantizedNode(AlternativesNode):
         self.add_alternative(q_node)
         q_node.add_edge('next', node)
         node.quantize(x_scale)
-        w_scale = node.scale
         next_node = self.get_node('next')
-        deq_node = DequantizeNode(w_scale, x_scale, next_node, node)
+        deq_node = DequantizeNode(next_node, node)
+
+        # The accumulation of the quantized node may be finished after its content, so a fused ReLU is applied
+        # when dequantizing.
+        deq_node.relu = getattr(node, 'relu', False)
+        node.relu = False
         node.add_edge('next', deq_node)
         assert next_node.in_dim == deq_node.out_dim
         self.get_node('next').in_var = deq_node.out_var
@@ -54,10 +58,10 @@ class QuantizedNode(AlternativesNode):
             v = abs(min)
         else:
             v = abs(max)
-        if type == 'int8':
-            return v / 127
-        elif type == 'uint8':
-            return v / 256
+        # Both int8 and uint8 use 127 as maximum. For uint8 only 7 bit are used, PMADDUBSW adds two products of
+        # uint8 and int8 with saturation to int16, with inputs up to 127 this sum can not saturate.
+        assert type in ['int8', 'uint8']
+        return v / 127
 
 
 class QuantizeNode(Node):
@@ -77,7 +81,8 @@ class QuantizeNode(Node):
         self.out_dim = self.in_dim
         self.out_var = Allocation.allocate_var(dtype, 'x', self.out_dim)
         self.out_var.change_padding(self.in_var.pads)
-        self.x_scale = x_scale
+        self.out_var.scale = x_scale
+        self.dtype = dtype
 
     def lowering(self):
         """
@@ -91,7 +96,15 @@ class QuantizeNode(Node):
         out_var_idx = IndexedVariable(self.out_var)
         in_var_idx.set_indices(idxs)
         out_var_idx.set_indices(idxs)
-        div_node = MultNode(out_var_idx, in_var_idx, Constant(1 / self.x_scale))
+        x_scale = self.out_var.scale
+        if self.dtype == 'uint8':
+            # Round to nearest and clip values larger than seen during calibration instead of letting them overflow.
+            div_node = ConditionalNode(out_var_idx,
+                                       Expression('{x} < {x_max}', x=in_var_idx, x_max=Constant.get(127 * x_scale)),
+                                       Expression('{x} * {s} + 0.5f', x=in_var_idx, s=Constant.get(1 / x_scale)),
+                                       Constant.get(127))
+        else:
+            div_node = MultNode(out_var_idx, in_var_idx, Constant.get(1 / x_scale))
         loops[-1].add_edge('content', div_node)
         self.add_edge('content', loops[0])
         self.var_decls.append(self.out_var)
@@ -101,11 +114,10 @@ class DequantizeNode(Node):
     """
     Class for converting quantized values to float again.
     """
-    def __init__(self, const_scale, x_scale, next_node, prev_node):
+    def __init__(self, next_node, prev_node):
         """
-        Init the node.
-        :param const_scale: Scaling factor used for quantizing the constant weights.
-        :param x_scale: Scaling factor used for quantizing the input layer.
+        Init the node. The scale of the quantized values is given by the output Variable of prev_node.
+        :param next_node: The next node, its input is the float output of this node.
         :param prev_node: The previous node.
         """
         super().__init__()
@@ -113,8 +125,7 @@ class DequantizeNode(Node):
         self.in_dim = prev_node.out_dim
         self.out_dim = self.in_dim
         self.out_var = next_node.in_var
-        self.x_scale = x_scale
-        self.const_scale = const_scale
+        self.relu = False
 
     def lowering(self):
         """
@@ -128,6 +139,14 @@ class DequantizeNode(Node):
         out_var_idx = IndexedVariable(self.out_var)
         in_var_idx.set_indices(idxs)
         out_var_idx.set_indices(idxs)
-        div_node = MultNode(out_var_idx, in_var_idx, Constant(self.x_scale * self.const_scale))
+        scale = Constant.get(self.in_var.scale)
+        if self.relu:
+            div_node = ConditionalNode(out_var_idx, Expression('{x} < 0', x=in_var_idx), Constant.get(0),
+                                       Expression('{x} * {s}', x=in_var_idx, s=scale))
+        else:
+            div_node = MultNode(out_var_idx, in_var_idx, scale)
         loops[-1].add_edge('content', div_node)
         self.add_edge('content', loops[0])
+
+        # The output belongs to the original node which is not written if this alternative is selected.
+        self.var_decls.append(self.out_var)
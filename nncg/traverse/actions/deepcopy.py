@@ -1,7 +1,7 @@
 from typing import List, Dict
 from nncg.traverse.tree import Edge, TreeNode
 from nncg.traverse.traverseaction import TraverseAction
-from nncg.nodes.expressions import Variable
+from nncg.nodes.expressions import Variable, Constant
 
 
 class DeepCopy(TraverseAction):
@@ -37,10 +37,12 @@ class DeepCopy(TraverseAction):
     def _follow_edge(self, edge: Edge):
         """
         Internal function to answer if the edge should be followed. It should if the target of the edge is not a
-        Variable or n_type of the Edge is not in excluding_edge_types.
+        Variable or shared Constant and n_type of the Edge is not in excluding_edge_types.
         :param edge: True or False.
         :return:
         """
+        if isinstance(edge.target, Constant) and edge.target.shared:
+            return False
         return edge.n_type not in self.excluding_edge_types and type(edge.target) is not Variable
 
     def _pre_action(self, edge: Edge) -> bool:
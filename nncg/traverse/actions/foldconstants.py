@@ -0,0 +1,20 @@
+from nncg.traverse.traverseaction import TraverseAction
+from nncg.nodes.expressions import Expression
+
+
+class FoldConstants(TraverseAction):
+    """
+    Action for the partial evaluation of all Expressions, see Expression.fold_constants(). Apply it only when the
+    graph does not change anymore, i.e. right before writing the C code.
+    """
+
+    def _post_action(self, edge) -> bool:
+        """
+        Fold the Constants of the target if it is an Expression. Done after visiting the edges of the target so that
+        nested Expressions are folded first and can be written into the outer one.
+        :param edge: The currently visited Edge.
+        :return: Always True.
+        """
+        if type(edge.target) is Expression:
+            edge.target.fold_constants()
+        return True
@@ -1,5 +1,5 @@
 from copy import copy
-from typing import List, Type
+from typing import List, Set, Type
 from nncg.traverse.traverseaction import TraverseAction
 from nncg.traverse.tree import TreeNode, Edge
 
@@ -11,63 +11,81 @@ class SearchNode(TraverseAction):
     result: List[List[TreeNode]]  # Stores the result. A single result is a List of TreeNodes which stores the complete
                                   # path that is visited to reach the result.
     cur_path_stack: List[TreeNode]
+    skip_edge_types: Set[str]
+    default_skip_edge_types: Set[str] = set()  # Searching for an instance must also see the operands of Expressions.
 
-    def __init__(self, search_for):
+    def __init__(self, search_for, skip_edge_types=None):
         """
         Init the arction.
         :param search_for: The node to be searched for.
+        :param skip_edge_types: Edges with an n_type in this set are neither followed nor their targets matched.
+                                None to use the default of this search variant.
         """
         super().__init__()
         self.result = []
         self.search_for = search_for
         self.cur_path_stack = []
+        self.skip_edge_types = set(self.default_skip_edge_types if skip_edge_types is None else skip_edge_types)
 
     def _pre_action(self, edge: Edge) -> bool:
         """
         Sets up a stack of passed nodes. See overwritten method for details.
         :param edge: Currently visited edge.
-        :return: Always True.
+        :return: False if the type of the edge is skipped, otherwise True.
         """
+        if edge.n_type in self.skip_edge_types:
+            return False
         self.cur_path_stack.append(edge.target)
         return True
 
     def _post_action(self, edge: Edge):
         """
-        If target of currently visited Edge is equal to the searched node the stack is added to result.
-        See overwritten method for details.
+        If the target of the currently visited Edge matches, the stack is added to result. Only hits copy the
+        stack, so the costs per visited edge are just the push and pop. See overwritten method for details.
         :param edge: Currently visited edge.
         :return: Always True.
         """
-        if edge.target == self.search_for:
+        if edge.n_type in self.skip_edge_types:
+            return
+        if self._match(edge.target):
             self.result.append(copy(self.cur_path_stack))
         self.cur_path_stack.pop()
 
+    def _match(self, node: TreeNode) -> bool:
+        """
+        Is this node a result of the search? Overwrite this in variants of this search.
+        :param node: The target of the currently visited edge.
+        :return: True if it is the searched node (same instance).
+        """
+        return node is self.search_for
+
 
 class SearchNodeByType(SearchNode):
     """
-    Variant of SearchNode. Here we search for a type of node.
+    Variant of SearchNode. Here we search for a type of node. The operands of Expressions ('m_expr' edges) are
+    skipped by default, they are Variables and Constants and no structural nodes.
     """
-    def _post_action(self, edge: Edge):
+    default_skip_edge_types = {'m_expr'}
+
+    def _match(self, node: TreeNode) -> bool:
         """
-        If type of target of currently visited Edge is equal to the searched type the stack is added to result.
-        See overwritten method for details.
-        :param edge: Currently visited edge.
-        :return: Always True.
+        Is the type of the node equal to the searched type?
+        :param node: The target of the currently visited edge.
+        :return: True or False.
         """
-        if type(edge.target) == self.search_for:
-            self.result.append(copy(self.cur_path_stack))
-        self.cur_path_stack.pop()
+        return type(node) == self.search_for
 
     @staticmethod
-    def get_next(root_node, node_type, traverse_edges=None):
+    def get_next(root_node, node_type, traverse_edges=None, skip_edge_types=None):
         """
         Just search for the first occurance and return it.
         :param root_node: Start search here.
         :param node_type: Search for this Node type.
         :param traverse_edges: List of edges that should be followed, None if default.
+        :param skip_edge_types: Edge types not to follow, None if default.
         :return: The first found occurance.
         """
-        action = SearchNodeByType(node_type)
+        action = SearchNodeByType(node_type, skip_edge_types)
         action.traverse_edges = traverse_edges
         root_node.traverse(action)
         return action.result[-1][-1]
@@ -75,15 +93,16 @@ class SearchNodeByType(SearchNode):
 
 class SearchNodeByName(SearchNode):
     """
-    Variant of SearchNode. Here we search for a node name.
+    Variant of SearchNode. Here we search for a node name. Like SearchNodeByType, 'm_expr' edges are skipped
+    by default.
     """
-    def _post_action(self, edge: Edge):
+    default_skip_edge_types = {'m_expr'}
+
+    def _match(self, node: TreeNode) -> bool:
         """
-        If the name of the target of the currently visited Edge is equal to the searched type the stack
-        is added to result. See overwritten method for details.
-        :param edge: Currently visited edge.
-        :return: Always True.
+        Is the name of the node equal to the searched name? This converts every visited node to a string which
+        can be expensive for Expressions. Prefer SearchNode if the instance is known.
+        :param node: The target of the currently visited edge.
+        :return: True or False.
         """
-        if str(edge.target) == self.search_for:
-            self.result.append(copy(self.cur_path_stack))
-        self.cur_path_stack.pop()
+        return str(node) == self.search_for
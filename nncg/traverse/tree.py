@@ -12,6 +12,10 @@ class TreeNode:
     """
     edges: Dict[str, Edge]
 
+    # Counts the changes in the graph. Nodes caching something that depends on the nodes below them, e.g. their
+    # string, compare with this number to detect that the cache is outdated.
+    modifications = 0
+
     def __init__(self):
         """
         Init the class.
@@ -168,6 +172,7 @@ class TreeNode:
                 self.edges.get(name).inverse.remove()
         edge = Edge(name, target, self, n_type, inverse)
         self.edges[name] = edge
+        TreeNode.modifications += 1
         return edge
 
     def search_path_end(self, edge_name) -> TreeNode:
@@ -430,6 +435,7 @@ class Edge:
             del self.owner.edges[self.name]
         if self.inverse.owner.edges.get(self.inverse.name) == self.inverse:
             del self.inverse.owner.edges[self.inverse.name]
+        TreeNode.modifications += 1
 
     def insert_node(self, node: TreeNode):
         """
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from typing import List
 import numpy as np
 
 
@@ -42,6 +43,18 @@ class Writer:
         """
         d.tofile(name)
 
+    @staticmethod
+    def write_blob(ds: List[np.ndarray], name):
+        """
+        Write multiple arrays, e.g. all weights, one after the other into a single binary file.
+        :param ds: List of data as ndarray.
+        :param name: Name of the file.
+        :return: None.
+        """
+        with open(name, 'wb') as f:
+            for d in ds:
+                f.write(np.ascontiguousarray(d).tobytes())
+
     @staticmethod
     def open(path):
         """